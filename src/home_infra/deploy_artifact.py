@@ -0,0 +1,30 @@
+"""
+Deploy file distributing one artifact across the inventory's sites.
+
+The artifact and, optionally, the fanout are passed as data:
+
+.. code:: bash
+
+    pyinfra src/home_infra/inventories/docker_sites.py src/home_infra/deploy_artifact.py \
+        --data artifact=dist/tool.deb --data artifact_fanout=2
+
+Note: Some type checking warnings remain due to incomplete type information
+for the pyinfra API. These warnings do not affect functionality.
+"""
+
+from pyinfra.api.exceptions import DeployError
+from pyinfra.context import host, state
+
+from home_infra.operations import artifacts
+from home_infra.tasks.artifacts import distribute_artifact
+
+artifact = host.data.get("artifact")
+if not artifact:
+    raise DeployError("pass the artifact to distribute with --data artifact=<path>")
+
+distribute_artifact(
+    state=state,
+    host=host,
+    src=artifact,
+    fanout=int(host.data.get("artifact_fanout") or artifacts.DEFAULT_FANOUT),
+)
@@ -0,0 +1,288 @@
+"""
+Facts for hosts managed with nala.
+
+Note: Some type checking warnings remain due to incomplete type information
+for the pyinfra API. These warnings do not affect functionality.
+"""
+
+import re
+import shlex
+from typing import Any, Dict, List, Optional
+from urllib.parse import unquote
+
+from pyinfra.api.facts import FactBase
+
+# Where nala operations record time spent waiting on the apt/dpkg locks
+DPKG_LOCK_WAIT_LOG = "/var/log/home_infra/dpkg-lock-wait.log"
+
+# Where apt/nala keep downloaded .deb archives
+APT_ARCHIVES_DIR = "/var/cache/apt/archives"
+
+
+class DpkgLockWaits(FactBase[List[Dict[str, Any]]]):
+    """
+    Returns the apt/dpkg lock waits recorded by nala operations run with ``lock_timeout``:
+
+    .. code:: python
+
+        [
+            {
+                "time": 1760000000,
+                "operation": "nala.packages",
+                "waited": 45,
+                "timed_out": False,
+            },
+        ]
+    """
+
+    default = list
+
+    def command(self) -> str:
+        return f"cat {DPKG_LOCK_WAIT_LOG} 2>/dev/null || true"
+
+    def process(self, output: List[str]) -> List[Dict[str, Any]]:
+        waits: List[Dict[str, Any]] = []
+
+        for line in output:
+            parts = line.split()
+            if len(parts) != 4 or not parts[0].isdigit() or not parts[2].isdigit():
+                continue
+
+            waits.append(
+                {
+                    "time": int(parts[0]),
+                    "operation": parts[1],
+                    "waited": int(parts[2]),
+                    "timed_out": parts[3] == "timeout",
+                }
+            )
+
+        return waits
+
+
+def _upgrade_targets(packages: Optional[List[str]], origin: Optional[str]) -> str:
+    """
+    Shell snippet selecting the installed packages with a pending upgrade.
+
+    Upgradable packages are filtered down to ``packages`` and/or to those whose
+    candidate comes from a suite containing ``origin`` (eg ``security``). Held
+    packages are always left out, as a plain ``nala upgrade`` would.
+    """
+    wanted = f" {' '.join(packages)} " if packages else ""
+    return (
+        "$(apt list --upgradable 2>/dev/null | awk -F'[/ ]' "
+        f"-v origin={shlex.quote(origin or '')} -v wanted={shlex.quote(wanted)} "
+        "-v held=\" $(apt-mark showhold 2>/dev/null | tr '\\n' ' ') \" "
+        "'NF > 2 "
+        '&& (origin == "" || index($2, origin)) '
+        '&& (wanted == "" || index(wanted, " " $1 " ")) '
+        '&& !index(held, " " $1 " ") '
+        "{print $1}')"
+    )
+
+
+class UpgradePlan(FactBase[Dict[str, Any]]):
+    """
+    Returns the dependency closure and download size of a (targeted) upgrade:
+
+    + packages: only upgrade these packages (and whatever they depend on)
+    + origin: only upgrade packages whose candidate comes from a matching suite, eg ``security``
+    + simulate: without ``packages``/``origin``, plan this whole-host apt-get action
+      (``upgrade`` or ``dist-upgrade``) instead of upgrading every upgradable package
+
+    .. code:: python
+
+        {
+            "packages": {
+                "libssl3": {"from": "3.0.2-0ubuntu1.14", "to": "3.0.2-0ubuntu1.15"},
+                "new-dependency": {"from": None, "to": "1.0-1"},
+            },
+            "download_size": 2372468,
+        }
+    """
+
+    default = dict
+
+    _inst_regex = r"^Inst (\S+) (?:\[(\S+)\] )?\((\S+) "
+    _uri_regex = r"^'\S+' \S+ (\d+) "
+
+    def requires_command(self, *args: Any, **kwargs: Any) -> str:
+        return "apt-get"
+
+    def command(
+        self,
+        packages: Optional[List[str]] = None,
+        origin: Optional[str] = None,
+        simulate: Optional[str] = None,
+    ) -> str:
+        apt_get = "apt-get -o Debug::NoLocking=1"
+        if simulate and not packages and not origin:
+            return "; ".join(
+                [
+                    f"{apt_get} -s {simulate} 2>/dev/null",
+                    f"{apt_get} -qq -y --print-uris {simulate} 2>/dev/null",
+                    "true",
+                ]
+            )
+
+        return "; ".join(
+            [
+                f"targets={_upgrade_targets(packages, origin)}",
+                '[ -n "$targets" ] || exit 0',
+                f"{apt_get} -s install --only-upgrade $targets 2>/dev/null",
+                f"{apt_get} -qq -y --print-uris install --only-upgrade $targets 2>/dev/null",
+                "true",
+            ]
+        )
+
+    def process(self, output: List[str]) -> Dict[str, Any]:
+        packages: Dict[str, Dict[str, Optional[str]]] = {}
+        download_size = 0
+
+        for line in output:
+            matches = re.match(self._inst_regex, line)
+            if matches:
+                name, current_version, new_version = matches.groups()
+                packages[name] = {"from": current_version, "to": new_version}
+                continue
+
+            matches = re.match(self._uri_regex, line)
+            if matches:
+                download_size += int(matches.group(1))
+
+        if not packages:
+            return {}
+
+        return {"packages": packages, "download_size": download_size}
+
+
+class PackageServices(FactBase[List[str]]):
+    """
+    Returns the system services (units under ``system.slice``) with a process that
+    has a shared library from any of the given packages mapped into memory:
+
+    + packages: list of package names
+
+    .. code:: python
+
+        ["nginx.service", "ssh.service"]
+    """
+
+    default = list
+
+    def requires_command(self, *args: Any, **kwargs: Any) -> str:
+        return "dpkg"
+
+    def command(self, packages: List[str]) -> str:
+        # Match on the library's basename so usrmerge'd paths (/lib vs /usr/lib) still line up
+        return "; ".join(
+            [
+                (
+                    f"libs=$(dpkg -L {' '.join(shlex.quote(package) for package in packages)} "
+                    "2>/dev/null | grep '\\.so' | sed 's|.*/|/|')"
+                ),
+                '[ -n "$libs" ] || exit 0',
+                # Only system services, not units under a user's systemd (user@*.service)
+                (
+                    'for maps in /proc/[0-9]*/maps; do grep -qF "$libs" "$maps" 2>/dev/null '
+                    "&& sed -n 's|^[^:]*:[^:]*:/system\\.slice/\\([^/]*\\.slice/\\)*"
+                    '\\([^/]*\\.service\\)$|\\2|p\' "${maps%/maps}/cgroup"; '
+                    "done | sort -u"
+                ),
+            ]
+        )
+
+    def process(self, output: List[str]) -> List[str]:
+        return [line.strip() for line in output if line.strip()]
+
+
+class ArchiveCache(FactBase[Dict[str, Any]]):
+    """
+    Returns the .deb archives cached by apt/nala, along with the held packages and
+    how often each package has been installed or reinstalled according to dpkg's logs
+    (upgrades to a new version don't count):
+
+    .. code:: python
+
+        {
+            "size": 3455000,
+            "packages": {
+                "openssl": [
+                    {
+                        "version": "3.0.15-1~deb12u1",
+                        "arch": "amd64",
+                        "filename": "openssl_3.0.15-1~deb12u1_amd64.deb",
+                        "size": 1428000,
+                        "accessed": 1760000000,
+                        "modified": 1750000000,
+                    },
+                ],
+            },
+            "held": ["linux-image-amd64"],
+            "installs": {"openssl": 4},
+        }
+
+    Each package's archives are ordered newest (by modification time) first.
+    """
+
+    default = dict
+
+    def command(self) -> str:
+        return "; ".join(
+            [
+                (
+                    f"find {APT_ARCHIVES_DIR} -maxdepth 1 -name '*.deb' "
+                    "-printf 'deb %s %A@ %T@ %f\\n' 2>/dev/null"
+                ),
+                "apt-mark showhold 2>/dev/null | sed 's/^/hold /'",
+                (
+                    "zcat -f /var/log/dpkg.log* 2>/dev/null "
+                    # dpkg logs a reinstall as an upgrade to the same version
+                    '| awk \'$3 == "install" || ($3 == "upgrade" && $5 == $6) '
+                    '{sub(/:.*/, "", $4); print $4}\' '
+                    "| sort | uniq -c | awk '{print \"installs\", $1, $2}'"
+                ),
+            ]
+        )
+
+    def process(self, output: List[str]) -> Dict[str, Any]:
+        packages: Dict[str, List[Dict[str, Any]]] = {}
+        held: List[str] = []
+        installs: Dict[str, int] = {}
+        size = 0
+
+        for line in output:
+            parts = line.split()
+            if not parts:
+                continue
+
+            if parts[0] == "deb" and len(parts) == 5:
+                filename = parts[4]
+                name_version_arch = filename[: -len(".deb")].split("_")
+                if len(name_version_arch) != 3:
+                    continue
+
+                name, version, arch = name_version_arch
+                archive_size = int(parts[1])
+                size += archive_size
+                packages.setdefault(name, []).append(
+                    {
+                        "version": unquote(version),
+                        "arch": arch,
+                        "filename": filename,
+                        "size": archive_size,
+                        "accessed": int(float(parts[2])),
+                        "modified": int(float(parts[3])),
+                    }
+                )
+
+            elif parts[0] == "hold" and len(parts) == 2:
+                held.append(parts[1])
+
+            elif parts[0] == "installs" and len(parts) == 3:
+                installs[parts[2]] = int(parts[1])
+
+        for archives in packages.values():
+            archives.sort(key=lambda archive: archive["modified"], reverse=True)
+
+        return {"size": size, "packages": packages, "held": held, "installs": installs}
@@ -0,0 +1,30 @@
+"""
+Docker inventory simulating two LAN sites, for testing artifact distribution.
+
+Each site is a separate docker network, so peers only reach each other by
+container name within their own site. The ``@docker/<name>`` entries attach to
+existing containers, which need python3 (to serve) and wget (to pull):
+
+.. code:: bash
+
+    for site in site-a site-b; do docker network create "$site"; done
+    for name in site-a-1 site-a-2 site-a-3 site-a-4 site-a-5 site-b-1 site-b-2; do
+        docker run -d --name "$name" --hostname "$name" --network "${name%-*}" \\
+            debian:bookworm sleep infinity
+        docker exec "$name" sh -c "apt-get update && apt-get install -y python3 wget"
+    done
+
+See ``home_infra/deploy_artifact.py`` for running a distribution against them.
+"""
+
+# With the default fanout of 3, site-a-2..4 pull from the seed and site-a-5 pulls
+# from site-a-2
+docker_sites = [
+    ("@docker/site-a-1", {"site": "site-a", "artifact_seed": True, "artifact_address": "site-a-1"}),
+    ("@docker/site-a-2", {"site": "site-a", "artifact_address": "site-a-2"}),
+    ("@docker/site-a-3", {"site": "site-a", "artifact_address": "site-a-3"}),
+    ("@docker/site-a-4", {"site": "site-a", "artifact_address": "site-a-4"}),
+    ("@docker/site-a-5", {"site": "site-a", "artifact_address": "site-a-5"}),
+    ("@docker/site-b-1", {"site": "site-b", "artifact_address": "site-b-1"}),
+    ("@docker/site-b-2", {"site": "site-b", "artifact_address": "site-b-2"}),
+]
@@ -0,0 +1,251 @@
+"""
+Operations for distributing controller-pushed artifacts across a site's LAN.
+
+Rather than uploading an artifact from the controller to every host, it is
+uploaded once per site to a seed host. The rest of the site then pulls it over
+HTTP from a peer that already has it, in a fan-out tree where each host serves
+at most ``fanout`` others. Every host verifies the artifact's SHA256 before
+keeping it.
+
+Hosts are grouped into sites by their ``site`` data; a host without one is a
+site of its own, which makes distribution a plain upload. Only hosts taking part
+in the run count: connected, and within any ``--limit``. The seed is the host
+with ``artifact_seed`` data set, otherwise the first host of the site by name.
+Peers reach each other at their ``artifact_address`` data, defaulting to the
+host name, and only listen on that address. Nothing but the artifact being
+distributed is served, and servers stop at the end of the distribution or after
+``ARTIFACT_SERVER_MAX_SECONDS``.
+
+Distributed artifacts land in ``ARTIFACT_CACHE_DIR`` and can be used from there,
+eg ``nala.deb(src=artifacts.artifact_path("debs/tool.deb"))``. See
+``tasks.artifacts.distribute_artifact`` for the full seed/pull/stop sequence.
+
+Note: Some type checking warnings remain due to incomplete type information
+for the pyinfra API. These warnings do not affect functionality.
+"""
+
+import os
+from typing import Any, Generator, List, Optional, Tuple, Union, cast
+
+from pyinfra.api.command import FileUploadCommand
+from pyinfra.api.host import Host
+from pyinfra.api.operation import operation
+from pyinfra.api.state import State
+from pyinfra.api.util import get_file_sha256
+from pyinfra.facts.files import Sha256File
+
+# Where artifacts are kept on every host
+ARTIFACT_CACHE_DIR = "/var/cache/home_infra/artifacts"
+
+# Holds a hard link to just the artifact being distributed, the only file peers can fetch
+ARTIFACT_SERVE_DIR = f"{ARTIFACT_CACHE_DIR}/.serving"
+
+# Port peers serve the artifact on while distributing
+ARTIFACT_PORT = 8765
+
+# Pid file of the artifact server, used to avoid starting it twice and to stop it
+ARTIFACT_SERVER_PID = "/run/home_infra-artifacts.pid"
+
+# Artifact servers shut themselves down after this many seconds regardless
+ARTIFACT_SERVER_MAX_SECONDS = 3600
+
+# How long a newly started artifact server has to answer before the operation fails
+ARTIFACT_SERVER_START_SECONDS = 10
+
+# Attempts per peer when pulling, refused connections included
+ARTIFACT_PULL_TRIES = 5
+
+# Number of peers each host serves the artifact to
+DEFAULT_FANOUT = 3
+
+
+def artifact_path(src: str) -> str:
+    """
+    Returns the path an artifact uploaded from ``src`` is distributed to.
+    """
+    return f"{ARTIFACT_CACHE_DIR}/{os.path.basename(src)}"
+
+
+def _run_hosts(state: State) -> List[Any]:
+    """
+    Returns the hosts operations run on: those that connected, within any limit.
+    """
+    return [host for host in state.inventory.iter_activated_hosts() if state.is_host_in_limit(host)]
+
+
+def _site_hosts(state: State, host: Host) -> List[Any]:
+    """
+    Returns the hosts in ``host``'s site, seed first and the rest by name.
+    """
+    site = host.data.get("site")
+    if site is None:
+        return [host]
+
+    hosts = sorted(
+        (other for other in _run_hosts(state) if other.data.get("site") == site),
+        key=lambda other: other.name,
+    )
+    seeds = [other for other in hosts if other.data.get("artifact_seed")]
+    if seeds:
+        hosts.remove(seeds[0])
+        hosts.insert(0, seeds[0])
+
+    return hosts
+
+
+def site_tree(state: State, host: Host, fanout: int) -> Tuple[Optional[Any], int, List[Any]]:
+    """
+    Returns ``host``'s parent (``None`` for the seed), depth and children in its
+    site's fan-out tree.
+
+    Hosts are laid out breadth first, so host ``i`` pulls from host ``(i - 1) // fanout``.
+    """
+    hosts = _site_hosts(state, host)
+    index = next(i for i, other in enumerate(hosts) if other.name == host.name)
+
+    depth = 0
+    position = index
+    while position:
+        position = (position - 1) // fanout
+        depth += 1
+
+    parent = hosts[(index - 1) // fanout] if index else None
+    children = hosts[index * fanout + 1 : index * fanout + 1 + fanout]
+    return parent, depth, children
+
+
+def site_tree_depth(state: State, fanout: int = DEFAULT_FANOUT) -> int:
+    """
+    Returns the depth of the deepest fan-out tree across all sites in this run.
+    """
+    return max((site_tree(state, host, fanout)[1] for host in _run_hosts(state)), default=0)
+
+
+def _address(host: Any) -> str:
+    return host.data.get("artifact_address") or host.name
+
+
+def _verify(path: str, sha256: str) -> str:
+    return f"echo '{sha256}  {path}' | sha256sum -c --quiet || {{ rm -f {path}; exit 1; }}"
+
+
+def _url(host: Any, path: str) -> str:
+    return f"http://{_address(host)}:{ARTIFACT_PORT}/{os.path.basename(path)}"
+
+
+def _serve(host: Host, path: str) -> str:
+    # A server left running from an earlier artifact picks up the new serve directory.
+    # Peers pull as soon as this returns, so wait until the artifact can be fetched.
+    url = _url(host, path)
+    return (
+        f"rm -rf {ARTIFACT_SERVE_DIR} && mkdir -p {ARTIFACT_SERVE_DIR} && "
+        f"ln -f {path} {ARTIFACT_SERVE_DIR}/ && "
+        f'{{ [ -f {ARTIFACT_SERVER_PID} ] && kill -0 "$(cat {ARTIFACT_SERVER_PID})" 2>/dev/null || '
+        f"{{ setsid nohup timeout {ARTIFACT_SERVER_MAX_SECONDS} python3 -m http.server "
+        f"{ARTIFACT_PORT} --bind {_address(host)} --directory {ARTIFACT_SERVE_DIR} "
+        f"</dev/null >/dev/null 2>&1 & echo $! > {ARTIFACT_SERVER_PID}; }}; }} && "
+        "waited=0; until python3 -c 'import sys, urllib.request; "
+        f"urllib.request.urlopen(sys.argv[1], timeout=1)' {url} 2>/dev/null; do "
+        f'if [ "$waited" -ge {ARTIFACT_SERVER_START_SECONDS} ]; then '
+        f'echo "artifact server not answering at {url}" >&2; exit 1; fi; '
+        "sleep 1; waited=$((waited + 1)); done"
+    )
+
+
+@operation()
+def seed(
+    state: State,
+    host: Host,
+    src: str,
+    fanout: int = DEFAULT_FANOUT,
+    sha256: Optional[str] = None,
+) -> Generator[Union[str, FileUploadCommand], None, None]:
+    """
+    Upload an artifact from the controller to the seed host of each site.
+
+    + src: local filename of the artifact
+    + fanout: number of peers each host serves the artifact to
+    + sha256: expected checksum, computed from ``src`` if not given
+
+    Seeds with peers to serve start serving the artifact afterwards.
+    """
+    _, depth, children = site_tree(state, host, fanout)
+    if depth != 0:
+        return
+
+    if sha256 is None:
+        sha256 = cast(str, get_file_sha256(src))
+    dest = artifact_path(src)
+
+    if host.get_fact(Sha256File, dest) != sha256:
+        yield f"mkdir -p {ARTIFACT_CACHE_DIR}"
+        yield FileUploadCommand(src, dest)
+        yield _verify(dest, sha256)
+
+    if children:
+        yield _serve(host, dest)
+
+
+@operation()
+def pull(
+    state: State,
+    host: Host,
+    src: str,
+    depth: int,
+    fanout: int = DEFAULT_FANOUT,
+    sha256: Optional[str] = None,
+) -> Generator[str, None, None]:
+    """
+    Pull an artifact from a peer, for the hosts at one depth of the fan-out tree.
+
+    + src: local filename the artifact was seeded from
+    + depth: only hosts this many hops from their seed pull
+    + fanout: number of peers each host serves the artifact to
+    + sha256: expected checksum, computed from ``src`` if not given
+
+    Hosts pull from their parent in the tree, falling back to the seed if the
+    parent can't serve it. Hosts with peers of their own start serving afterwards.
+    """
+    parent, host_depth, children = site_tree(state, host, fanout)
+    if parent is None or host_depth != depth:
+        return
+
+    if sha256 is None:
+        sha256 = cast(str, get_file_sha256(src))
+    dest = artifact_path(src)
+
+    if host.get_fact(Sha256File, dest) != sha256:
+        temp_dest = f"{dest}.part"
+
+        def fetch(source: Any) -> str:
+            return (
+                f"wget -q --tries={ARTIFACT_PULL_TRIES} --retry-connrefused --waitretry=1 "
+                f"-O {temp_dest} {_url(source, dest)}"
+            )
+
+        fetches = fetch(parent)
+        site_seed = _site_hosts(state, host)[0]
+        if site_seed.name != parent.name:
+            fetches += (
+                f' || {{ echo "{parent.name} unavailable, pulling from seed {site_seed.name}" >&2; '
+                f"{fetch(site_seed)}; }}"
+            )
+
+        yield f"mkdir -p {ARTIFACT_CACHE_DIR}"
+        yield fetches
+        yield _verify(temp_dest, sha256)
+        yield f"mv {temp_dest} {dest}"
+
+    if children:
+        yield _serve(host, dest)
+
+
+@operation()
+def stop_serving(state: State, host: Host) -> Generator[str, None, None]:
+    """
+    Stop the artifact server started by ``artifacts.seed`` or ``artifacts.pull``.
+    """
+    yield (
+        f'[ ! -f {ARTIFACT_SERVER_PID} ] || kill "$(cat {ARTIFACT_SERVER_PID})" 2>/dev/null; '
+        f"rm -rf {ARTIFACT_SERVER_PID} {ARTIFACT_SERVE_DIR}"
+    )
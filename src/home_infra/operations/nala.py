@@ -9,8 +9,9 @@ Note: Some type checking warnings remain due to incomplete type information
 for the pyinfra API. These warnings do not affect functionality.
 """
 
-from typing import Generator, List, Optional, Union
+from typing import Any, Generator, List, Optional, Union
 
+from pyinfra import logger
 from pyinfra.api.host import Host
 from pyinfra.api.operation import operation
 from pyinfra.api.state import State
@@ -18,6 +19,111 @@ from pyinfra.facts.apt import AptSources, SimulateOperationWillChange
 from pyinfra.facts.deb import DebPackage, DebPackages
 from pyinfra.facts.files import File
 from pyinfra.facts.server import Date
+from pyinfra.facts.systemd import SystemdStatus
+
+from home_infra.facts.nala import (
+    APT_ARCHIVES_DIR,
+    DPKG_LOCK_WAIT_LOG,
+    ArchiveCache,
+    DpkgLockWaits,
+    PackageServices,
+    UpgradePlan,
+)
+
+# Lock files taken by apt/dpkg while the package database or cache is in use
+DPKG_LOCK_FILES = [
+    "/var/lib/dpkg/lock-frontend",
+    "/var/lib/dpkg/lock",
+    "/var/lib/apt/lists/lock",
+    "/var/cache/apt/archives/lock",
+]
+
+# Longest single sleep between lock probes, in seconds
+DPKG_LOCK_MAX_BACKOFF = 30
+
+# Number of most recent waits kept in DPKG_LOCK_WAIT_LOG
+DPKG_LOCK_WAIT_LOG_LINES = 1000
+
+# Timers that kick off apt-daily/unattended-upgrades runs
+APT_TIMERS = ["apt-daily.timer", "apt-daily-upgrade.timer"]
+
+# Transient unit that restarts paused apt timers if the deploy never does
+APT_TIMERS_RESUME_UNIT = "home-infra-resume-apt-timers"
+
+# Unit name prefixes never restarted after an upgrade, restarting these drops sessions
+NO_RESTART_SERVICES = (
+    "dbus.service",
+    "dbus-broker.service",
+    "systemd-logind.service",
+    "user@",
+    "getty@",
+    "serial-getty@",
+)
+
+
+def _with_lock_wait(command: str, operation: str, lock_timeout: Optional[int]) -> str:
+    """
+    Wrap a nala command in a host-side wait for the apt/dpkg locks.
+
+    Lock holders are found by scanning ``/proc/*/fd`` for the lock files, so
+    nothing beyond coreutils/findutils is needed on the host. The probe backs off
+    exponentially (1s doubling up to ``DPKG_LOCK_MAX_BACKOFF``) and gives up once
+    ``lock_timeout`` seconds have been spent waiting. Another process can still
+    take the lock between the last probe and the command starting, so a command
+    that fails on a lock error (or while a new holder exists) is retried within
+    the same budget. The command's output (stdout and stderr together) is streamed
+    as it runs and kept to look for lock errors. Any wait is printed in the
+    operation's output and appended to ``DPKG_LOCK_WAIT_LOG`` (capped at
+    ``DPKG_LOCK_WAIT_LOG_LINES``) as ``<epoch> <operation> <seconds> <ok|failed|timeout>``.
+    """
+    if lock_timeout is None:
+        return command
+
+    lock_names = " -o ".join(f"-lname {path}" for path in DPKG_LOCK_FILES)
+    probe = (
+        f"holders=$(find /proc/[0-9]*/fd -maxdepth 1 \\( {lock_names} \\) 2>/dev/null"
+        " | cut -d/ -f3 | sort -u | tr '\\n' ' ')"
+    )
+    # Sleep for the current backoff, never past the timeout
+    backoff = (
+        f"remaining=$(({lock_timeout} - waited)); "
+        'if [ "$delay" -gt "$remaining" ]; then delay=$remaining; fi; '
+        'sleep "$delay"; waited=$((waited + delay)); delay=$((delay * 2)); '
+        f'if [ "$delay" -gt {DPKG_LOCK_MAX_BACKOFF} ]; then delay={DPKG_LOCK_MAX_BACKOFF}; fi'
+    )
+    log_dir = DPKG_LOCK_WAIT_LOG.rsplit("/", 1)[0]
+    log_tmp = f"{DPKG_LOCK_WAIT_LOG}.tmp"
+
+    def log_wait(status: str) -> str:
+        return (
+            f'echo "{operation} waited ${{waited}}s for dpkg lock ({status})"; '
+            f"mkdir -p {log_dir} && "
+            f'echo "$(date +%s) {operation} $waited {status}" >> {DPKG_LOCK_WAIT_LOG} && '
+            f"tail -n {DPKG_LOCK_WAIT_LOG_LINES} {DPKG_LOCK_WAIT_LOG} > {log_tmp} && "
+            f"mv {log_tmp} {DPKG_LOCK_WAIT_LOG}"
+        )
+
+    return (
+        "waited=0; delay=1; out=$(mktemp); while :; do "
+        f"{probe}; "
+        'while [ -n "$holders" ]; do '
+        f'if [ "$waited" -ge {lock_timeout} ]; then {log_wait("timeout")}; '
+        'echo "dpkg lock still held by pid(s) $holders after ${waited}s" >&2; '
+        'rm -f "$out" "$out.status"; exit 1; fi; '
+        f"{backoff}; {probe}; done; "
+        # No pipefail in sh, so the command's status goes through a file
+        f'{{ ( {command} ) 2>&1; echo $? >"$out.status"; }} | tee "$out"; '
+        'status=$(cat "$out.status" 2>/dev/null || echo 1); '
+        f'if [ "$status" -eq 0 ] || [ "$waited" -ge {lock_timeout} ]; then break; fi; '
+        f"{probe}; "
+        'if [ -z "$holders" ] && ! grep -qE "Could not get lock|Unable to lock" "$out"; '
+        "then break; fi; "
+        f"{backoff}; done; "
+        'rm -f "$out" "$out.status"; '
+        'if [ "$waited" -gt 0 ]; then '
+        f'if [ "$status" -eq 0 ]; then {log_wait("ok")}; else {log_wait("failed")}; fi; fi; '
+        '(exit "$status")'
+    )
 
 
 @operation()
@@ -51,12 +157,16 @@ def fetch(
 
 @operation()
 def update(
-    state: State, host: Host, cache_time: Optional[int] = None
+    state: State,
+    host: Host,
+    cache_time: Optional[int] = None,
+    lock_timeout: Optional[int] = None,
 ) -> Generator[str, None, None]:
     """
     Updates nala repositories.
 
     + cache_time: cache updates for this many seconds
+    + lock_timeout: wait up to this many seconds for apt/dpkg locks held by other processes
     """
     if cache_time:
         # If cache_time is provided, check when apt was last updated
@@ -70,37 +180,168 @@ def update(
             if time_since_update.total_seconds() < cache_time:
                 return
 
-        yield "nala update -y"
+        yield _with_lock_wait("nala update -y", "nala.update", lock_timeout)
 
         # Touch the update success stamp
         yield "mkdir -p /var/lib/apt/periodic"
         yield "touch /var/lib/apt/periodic/update-success-stamp"
     else:
-        yield "nala update -y"
+        yield _with_lock_wait("nala update -y", "nala.update", lock_timeout)
 
 
-@operation()
-def upgrade(state: State, host: Host) -> Generator[str, None, None]:
+def _upgrade(
+    host: Host,
+    operation: str,
+    command: str,
+    simulate: str,
+    packages: Optional[Union[str, List[str]]],
+    origin: Optional[str],
+    restart_services: bool,
+    lock_timeout: Optional[int],
+) -> Generator[str, None, None]:
     """
-    Upgrades all nala packages.
+    Shared implementation of ``upgrade`` and ``full_upgrade``.
+
+    Without a package subset or origin the whole host is upgraded with ``command``,
+    and any services to restart come from simulating ``apt-get <simulate>``. nala
+    resolves the upgrade itself, so the restart list approximates what it changes.
+    Otherwise the planned closure of already installed packages is pinned to its
+    candidate versions and upgraded with ``apt-get install --only-upgrade``, the
+    same command ``UpgradePlan`` simulated (nala has no only-upgrade mode). Unless
+    ``simulate`` is ``dist-upgrade`` this adds ``--no-remove``, so like a plain
+    upgrade it aborts rather than remove packages. Automatically installed packages
+    keep their auto mark, so a later autoremove behaves as before.
     """
-    will_change = host.get_fact(SimulateOperationWillChange, "upgrade")
-    if not will_change:
+    if isinstance(packages, str):
+        packages = [packages]
+
+    if not packages and not origin and not restart_services:
+        will_change = host.get_fact(SimulateOperationWillChange, simulate)
+        if not will_change:
+            return
+
+        yield _with_lock_wait(command, operation, lock_timeout)
         return
 
-    yield "nala upgrade -y"
+    if packages or origin:
+        plan = host.get_fact(UpgradePlan, packages=packages or None, origin=origin)
+    else:
+        # Restarting after a whole-host upgrade, plan the same apt action it performs
+        plan = host.get_fact(UpgradePlan, simulate=simulate)
+    if not plan:
+        host.noop("no matching packages to upgrade")
+        return
+
+    upgrading: dict[str, dict[str, Optional[str]]] = plan["packages"]
+
+    services: list[str] = []
+    if restart_services:
+        mapped_services: list[str] = host.get_fact(PackageServices, packages=sorted(upgrading))
+        services = [
+            service for service in mapped_services if not service.startswith(NO_RESTART_SERVICES)
+        ]
+
+    logger.info(
+        f"{host.print_prefix}{operation} will upgrade {len(upgrading)} package(s), "
+        f"{plan['download_size'] / 1024 / 1024:.1f} MB to download, "
+        f"restarting: {', '.join(services) if services else 'nothing'}"
+    )
+
+    if not packages and not origin:
+        yield _with_lock_wait(command, operation, lock_timeout)
+    else:
+        names = [name for name, versions in sorted(upgrading.items()) if versions["from"]]
+        install_command = [
+            "DEBIAN_FRONTEND=noninteractive",
+            "apt-get",
+            "install",
+            "-y",
+            "--only-upgrade",
+        ]
+        if simulate != "dist-upgrade":
+            install_command.append("--no-remove")
+        install_command.extend(f"{name}={upgrading[name]['to']}" for name in names)
+
+        # apt-get marks packages named on the command line as manually installed
+        yield _with_lock_wait(
+            f"auto=$(apt-mark showauto {' '.join(names)}); "
+            f"{' '.join(install_command)} && "
+            '{ [ -z "$auto" ] || apt-mark auto $auto >/dev/null; }',
+            operation,
+            lock_timeout,
+        )
+
+    # Only restart services that had a library from an upgraded package mapped
+    if services:
+        yield f"systemctl try-restart {' '.join(services)}"
 
 
 @operation()
-def full_upgrade(state: State, host: Host) -> Generator[str, None, None]:
+def upgrade(
+    state: State,
+    host: Host,
+    packages: Optional[Union[str, List[str]]] = None,
+    origin: Optional[str] = None,
+    restart_services: bool = False,
+    lock_timeout: Optional[int] = None,
+) -> Generator[str, None, None]:
     """
-    Updates all nala packages, employing full-upgrade.
+    Upgrades nala packages, either all of them or a targeted subset.
+
+    + packages: only upgrade these packages (plus any dependencies they need)
+    + origin: only upgrade packages whose candidate comes from a matching suite, eg ``security``
+    + restart_services: afterwards restart the services using libraries from upgraded packages
+    + lock_timeout: wait up to this many seconds for apt/dpkg locks held by other processes
+
+    Targeted upgrades:
+        With ``packages`` and/or ``origin`` the dependency closure is computed before
+        anything runs, and the number of packages, download size and services to
+        restart are logged while planning. Held packages are skipped. The upgrade runs
+        as ``apt-get install --only-upgrade --no-remove``: new dependencies may be
+        installed, but nothing is removed and auto-installed packages stay auto.
     """
-    will_change = host.get_fact(SimulateOperationWillChange, "dist-upgrade")
-    if not will_change:
-        return
+    yield from _upgrade(
+        host,
+        "nala.upgrade",
+        "nala upgrade -y",
+        "upgrade",
+        packages,
+        origin,
+        restart_services,
+        lock_timeout,
+    )
 
-    yield "nala full-upgrade -y"
+
+@operation()
+def full_upgrade(
+    state: State,
+    host: Host,
+    packages: Optional[Union[str, List[str]]] = None,
+    origin: Optional[str] = None,
+    restart_services: bool = False,
+    lock_timeout: Optional[int] = None,
+) -> Generator[str, None, None]:
+    """
+    Updates nala packages, employing full-upgrade.
+
+    + packages: only upgrade these packages (plus any dependencies they need)
+    + origin: only upgrade packages whose candidate comes from a matching suite, eg ``security``
+    + restart_services: afterwards restart the services using libraries from upgraded packages
+    + lock_timeout: wait up to this many seconds for apt/dpkg locks held by other processes
+
+    Targeted upgrades behave like ``nala.upgrade``'s, except that packages may be
+    removed to resolve conflicts (no ``--no-remove``).
+    """
+    yield from _upgrade(
+        host,
+        "nala.full_upgrade",
+        "nala full-upgrade -y",
+        "dist-upgrade",
+        packages,
+        origin,
+        restart_services,
+        lock_timeout,
+    )
 
 
 @operation()
@@ -114,6 +355,7 @@ def packages(
     allow_downgrades: bool = False,
     extra_install_args: str | None = None,
     extra_uninstall_args: Optional[str] = None,
+    lock_timeout: Optional[int] = None,
 ) -> Generator[str, None, None]:
     """
     Install/remove/update packages with nala.
@@ -125,6 +367,7 @@ def packages(
     + allow_downgrades: allow downgrading packages with version (--allow-downgrades)
     + extra_install_args: additional arguments to the nala install command
     + extra_uninstall_args: additional arguments to the nala uninstall command
+    + lock_timeout: wait up to this many seconds for apt/dpkg locks held by other processes
 
     Versions:
         Package versions can be pinned like apt: ``<pkg>=<version>``
@@ -181,7 +424,9 @@ def packages(
                     need_installing.append(package)
 
         if need_installing:
-            yield " ".join(install_command + need_installing)
+            yield _with_lock_wait(
+                " ".join(install_command + need_installing), "nala.packages", lock_timeout
+            )
 
     # Remove packages
     else:
@@ -204,16 +449,25 @@ def packages(
                 need_removing.append(name)
 
         if need_removing:
-            yield " ".join(uninstall_command + need_removing)
+            yield _with_lock_wait(
+                " ".join(uninstall_command + need_removing), "nala.packages", lock_timeout
+            )
 
 
 @operation()
-def deb(state: State, host: Host, src: str, present: bool = True) -> Generator[str, None, None]:
+def deb(
+    state: State,
+    host: Host,
+    src: str,
+    present: bool = True,
+    lock_timeout: Optional[int] = None,
+) -> Generator[str, None, None]:
     """
     Add/remove .deb file packages.
 
     + src: filename or URL of the .deb file
     + present: whether or not the package should exist on the system
+    + lock_timeout: wait up to this many seconds for apt/dpkg locks held by other processes
 
     Note:
         When installing, ``nala install -f`` will be run to install any unmet dependencies.
@@ -246,13 +500,14 @@ def deb(state: State, host: Host, src: str, present: bool = True) -> Generator[s
 
     # Install the package with nala -f
     if install:
-        yield f"nala install -y {src}"
-        yield "nala install -f -y"  # Install any missing dependencies
+        yield _with_lock_wait(f"nala install -y {src}", "nala.deb", lock_timeout)
+        # Install any missing dependencies
+        yield _with_lock_wait("nala install -f -y", "nala.deb", lock_timeout)
 
     # Remove the package
     elif not install and present is False:
         if info:
-            yield f"nala remove -y {info['name']}"
+            yield _with_lock_wait(f"nala remove -y {info['name']}", "nala.deb", lock_timeout)
         else:
             yield f"# No package information found for {src}"
 
@@ -295,3 +550,177 @@ def repo(
         else:
             # Otherwise, use sed to remove the line from sources.list
             yield f"sed -i '/^{src}$/d' /etc/apt/sources.list"
+
+
+@operation()
+def pause_apt_timers(state: State, host: Host, max_pause: int = 3600) -> Generator[str, None, None]:
+    """
+    Stop the apt-daily timers so they don't take the dpkg lock mid-deploy.
+
+    + max_pause: restart the timers after this many seconds if ``resume_apt_timers``
+      never runs (eg the deploy fails part way through)
+
+    Pair with ``nala.resume_apt_timers`` at the end of the deploy.
+    """
+    timers = host.get_fact(SystemdStatus) or {}
+    active_timers = [timer for timer in APT_TIMERS if timers.get(timer)]
+    if not active_timers:
+        return
+
+    yield f"systemctl stop {' '.join(active_timers)}"
+
+    # Safety net in case the deploy dies before resuming the timers
+    yield f"systemctl stop {APT_TIMERS_RESUME_UNIT}.timer 2>/dev/null || true"
+    yield (
+        f"systemd-run --unit={APT_TIMERS_RESUME_UNIT} --on-active={max_pause} "
+        f"systemctl start {' '.join(active_timers)}"
+    )
+
+
+@operation()
+def resume_apt_timers(state: State, host: Host) -> Generator[str, None, None]:
+    """
+    Restart the apt-daily timers stopped by ``nala.pause_apt_timers``.
+
+    Only timers that were active when the deploy was planned are restarted.
+    """
+    timers = host.get_fact(SystemdStatus) or {}
+    active_timers = [timer for timer in APT_TIMERS if timers.get(timer)]
+    if not active_timers:
+        return
+
+    yield f"systemctl stop {APT_TIMERS_RESUME_UNIT}.timer 2>/dev/null || true"
+    yield f"systemctl start {' '.join(active_timers)}"
+
+
+@operation()
+def lock_wait_report(state: State, host: Host) -> Generator[str, None, None]:
+    """
+    Report the apt/dpkg lock waits recorded on the host by earlier deploys.
+
+    Facts are collected while planning, so this covers previous runs only; waits
+    during this deploy show up in the output of the operation that waited.
+    """
+    # Only reports while planning, nothing runs on the host
+    yield from ()
+
+    waits = host.get_fact(DpkgLockWaits) or []
+    if not waits:
+        host.noop("no dpkg lock waits recorded")
+        return
+
+    waited_by_operation: dict[str, int] = {}
+    for wait in waits:
+        waited_by_operation[wait["operation"]] = (
+            waited_by_operation.get(wait["operation"], 0) + wait["waited"]
+        )
+    timed_out = sum(1 for wait in waits if wait["timed_out"])
+
+    host.noop(
+        f"{len(waits)} dpkg lock wait(s) recorded, {timed_out} timed out, waited: "
+        + ", ".join(
+            f"{name} {seconds}s"
+            for name, seconds in sorted(
+                waited_by_operation.items(), key=lambda item: item[1], reverse=True
+            )
+        )
+    )
+
+
+@operation()
+def archive_cache(
+    state: State,
+    host: Host,
+    budget: Optional[int] = None,
+    keep_versions: int = 2,
+    keep_packages: Optional[List[str]] = None,
+    reinstall_threshold: int = 3,
+    lock_timeout: Optional[int] = None,
+) -> Generator[str, None, None]:
+    """
+    Trim the apt archive cache (``/var/cache/apt/archives``) down to a retention policy.
+
+    + budget: maximum size of the cache in bytes, least recently used archives are
+      evicted until it fits
+    + keep_versions: number of most recent versions to keep of protected packages
+    + keep_packages: packages to protect, in addition to held packages
+    + reinstall_threshold: also protect packages installed or reinstalled (not merely
+      upgraded) at least this many times according to dpkg's logs
+    + lock_timeout: wait up to this many seconds for apt/dpkg locks held by other processes
+
+    Protected archives are never evicted, even if that leaves the cache over budget,
+    and archives the next upgrade would install are only evicted once nothing else is left.
+    The bytes freed, and how many of the next upgrade's packages would be served
+    from the cache, are logged while planning.
+    """
+    cache = host.get_fact(ArchiveCache) or {}
+    cached: dict[str, list[dict[str, Any]]] = cache.get("packages", {})
+
+    protected_packages = set(keep_packages or []) | set(cache.get("held", []))
+    protected_packages |= {
+        name for name, count in cache.get("installs", {}).items() if count >= reinstall_threshold
+    }
+
+    protected: list[dict[str, Any]] = []
+    evictable: list[dict[str, Any]] = []
+    for name, archives in cached.items():
+        # Archives are ordered newest first
+        keep = keep_versions if name in protected_packages else 0
+        protected.extend(archives[:keep])
+        evictable.extend(archives[keep:])
+
+    # Archives the next upgrade would install are evicted last
+    plan = host.get_fact(UpgradePlan, packages=None, origin=None) or {}
+    upgrading: dict[str, dict[str, Optional[str]]] = plan.get("packages", {})
+    planned_filenames = {
+        archive["filename"]
+        for name, versions in upgrading.items()
+        for archive in cached.get(name.split(":")[0], [])
+        if archive["version"] == versions["to"]
+    }
+
+    size: int = cache.get("size", 0)
+    evicted: list[dict[str, Any]] = []
+    if budget is not None:
+        for archive in sorted(
+            evictable,
+            key=lambda archive: (archive["filename"] in planned_filenames, archive["accessed"]),
+        ):
+            if size <= budget:
+                break
+            evicted.append(archive)
+            size -= archive["size"]
+
+    # How many of the next upgrade's packages would be served from what's left
+    evicted_filenames = {archive["filename"] for archive in evicted}
+    hits = sum(
+        1
+        for name, versions in upgrading.items()
+        if any(
+            archive["version"] == versions["to"] and archive["filename"] not in evicted_filenames
+            for archive in cached.get(name.split(":")[0], [])
+        )
+    )
+    hit_rate = f"{hits}/{len(upgrading)} ({hits / len(upgrading):.0%})" if upgrading else "n/a"
+
+    if budget is not None and size > budget:
+        logger.warning(
+            f"{host.print_prefix}nala.archive_cache: protected archives alone exceed the budget"
+        )
+
+    if not evicted:
+        host.noop(f"archive cache is within policy, next upgrade cache hits: {hit_rate}")
+        return
+
+    freed = sum(archive["size"] for archive in evicted)
+    logger.info(
+        f"{host.print_prefix}nala.archive_cache will evict {len(evicted)} archive(s), "
+        f"freeing {freed / 1024 / 1024:.1f} MB ({size / 1024 / 1024:.1f} MB left), "
+        f"next upgrade cache hits: {hit_rate}"
+    )
+
+    filenames = " ".join(
+        f"{APT_ARCHIVES_DIR}/{archive['filename']}"
+        for archive in sorted(evicted, key=lambda archive: archive["filename"])
+    )
+    yield _with_lock_wait(f"rm -f {filenames}", "nala.archive_cache", lock_timeout)
@@ -0,0 +1,57 @@
+"""
+Tasks for distributing controller-pushed artifacts across site LANs.
+
+Note: Some type checking warnings remain due to incomplete type information
+for the pyinfra API. These warnings do not affect functionality.
+"""
+
+import os
+
+from pyinfra.api.deploy import deploy
+from pyinfra.api.host import Host
+from pyinfra.api.state import State
+from pyinfra.api.util import get_file_sha256
+
+from home_infra.operations import artifacts
+
+
+@deploy("Distribute artifact")
+def distribute_artifact(
+    state: State, host: Host, src: str, fanout: int = artifacts.DEFAULT_FANOUT
+) -> None:
+    """
+    Upload an artifact once per site and fan it out to the rest of the site.
+
+    The controller uploads ``src`` to each site's seed, then every depth of the
+    fan-out tree pulls it from the depth above. pyinfra runs each operation on
+    all hosts before starting the next, so a host's parent always has the
+    artifact (and is serving it) by the time the host pulls.
+
+    pyinfra 3 doesn't pass ``state``/``host`` to deploys or operations, so callers
+    pass them explicitly (see ``home_infra/deploy_artifact.py``) and they are
+    handed on to each operation.
+    """
+    name = os.path.basename(src)
+    sha256 = get_file_sha256(src)
+
+    artifacts.seed(
+        state=state,
+        host=host,
+        name=f"Upload {name} to site seeds",
+        src=src,
+        fanout=fanout,
+        sha256=sha256,
+    )
+
+    for depth in range(1, artifacts.site_tree_depth(state, fanout) + 1):
+        artifacts.pull(
+            state=state,
+            host=host,
+            name=f"Pull {name} from peers (depth {depth})",
+            src=src,
+            depth=depth,
+            fanout=fanout,
+            sha256=sha256,
+        )
+
+    artifacts.stop_serving(state=state, host=host, name="Stop serving artifacts")
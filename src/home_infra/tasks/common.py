@@ -17,10 +17,17 @@ def install_common_packages(state: State, host: Host) -> None:
     """
     Install common packages that should be present on all hosts.
     """
+    # Show how much earlier deploys were held up by other apt/dpkg users
+    nala.lock_wait_report(name="Report dpkg lock waits")
+
+    # Keep apt-daily/unattended-upgrades from grabbing the dpkg lock mid-deploy
+    nala.pause_apt_timers(name="Pause apt timers")
+
     # Update nala repositories
     nala.update(
         name="Update nala repositories",
         cache_time=3600,
+        lock_timeout=600,
     )
 
     # Install common packages
@@ -34,10 +41,15 @@ def install_common_packages(state: State, host: Host) -> None:
             "kitty-terminfo",
             "docker.io",
         ],
+        lock_timeout=600,
     )
 
     # Install starship prompt
-    nala.packages(name="Install starship prompt", packages=["curl", "ca-certificates"])
+    nala.packages(
+        name="Install starship prompt",
+        packages=["curl", "ca-certificates"],
+        lock_timeout=600,
+    )
 
     # The starship installation requires a separate command
     # Using a raw command instead of yield to avoid return type issues
@@ -47,3 +59,5 @@ def install_common_packages(state: State, host: Host) -> None:
         name="Install starship prompt",
         commands=["curl -sS https://starship.rs/install.sh | sh -s -- --yes"],
     )
+
+    nala.resume_apt_timers(name="Resume apt timers")
@@ -5,7 +5,9 @@ This module provides stub classes for testing pyinfra operations without
 having to mock every attribute individually.
 """
 
-from typing import Any, Dict, List, Optional, Set, Tuple, Type, TypeVar
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple, Type, TypeVar, Union
+
+from pyinfra.api.command import FileUploadCommand
 
 T = TypeVar("T")
 
@@ -37,11 +39,23 @@ class PyinfraTestConfig:
         self.PARALLEL = False
 
 
+class PyinfraTestInventory:
+    """A stub for pyinfra Inventory."""
+
+    def __init__(self, hosts: Optional[List[Any]] = None) -> None:
+        self.hosts: List[Any] = hosts or []
+
+    def iter_activated_hosts(self) -> Iterator[Any]:
+        """Mock method that treats every host as connected."""
+        return iter(self.hosts)
+
+
 class PyinfraTestState:
     """A complete stub for pyinfra State."""
 
     def __init__(self) -> None:
-        self.inventory = None
+        self.inventory = PyinfraTestInventory()
+        self.limit_hosts: Optional[List[Any]] = None
         self.config = PyinfraTestConfig()
         self.in_deploy = False
         self.deploy_name: Optional[str] = None
@@ -51,6 +65,10 @@ class PyinfraTestState:
         self.is_executing = False
         self.ops: Dict[str, Any] = {}
 
+    def is_host_in_limit(self, host: "PyinfraTestHost") -> bool:
+        """Mock method that checks the host against limit_hosts, if set."""
+        return self.limit_hosts is None or host in self.limit_hosts
+
     def should_check_for_changes(self) -> bool:
         """Mock method that always returns False."""
         return False
@@ -67,8 +85,18 @@ class PyinfraTestState:
 class PyinfraTestHostData:
     """A stub for host data."""
 
-    def __init__(self):
-        pass
+    def __init__(self, data: Optional[Dict[str, Any]] = None):
+        self.__dict__["_data"] = data or {}
+
+    def __getattr__(self, key: str) -> Any:
+        try:
+            return self._data[key]
+        except KeyError:
+            raise AttributeError(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Get a data value, or the default if it isn't set."""
+        return self._data.get(key, default)
 
 
 class PyinfraTestHostMeta:
@@ -83,14 +111,20 @@ class PyinfraTestHostMeta:
 class PyinfraTestHost:
     """A complete stub for pyinfra Host."""
 
-    def __init__(self, facts: Optional[FactsDict] = None) -> None:
+    def __init__(
+        self,
+        facts: Optional[FactsDict] = None,
+        name: str = "test_host",
+        data: Optional[Dict[str, Any]] = None,
+    ) -> None:
         self.facts: FactsDict = facts or {}
         self.noop_description: Optional[str] = None
         self.in_op: bool = False
         self.in_deploy: bool = False
-        self.name: str = "test_host"
+        self.name: str = name
+        self.print_prefix: str = f"[{name}] "
         self.host_data: Dict[str, Any] = {}
-        self.data = PyinfraTestHostData()
+        self.data = PyinfraTestHostData(data)
         self.current_deploy_kwargs: Dict[str, Any] = {}
         self.current_deploy_name: Optional[str] = None
         self.current_deploy_data: Dict[str, Any] = {}
@@ -99,28 +133,46 @@ class PyinfraTestHost:
         self.loop_position: Optional[int] = None
         self.op_hashes: Set[str] = set()
 
-    def get_fact(self, fact_cls: Any, *args: Any) -> Any:
-        """Get a fact from this host."""
+    def noop(self, description: str) -> None:
+        """Record the description of a noop operation."""
+        self.noop_description = description
+
+    def get_fact(self, fact_cls: Any, *args: Any, **kwargs: Any) -> Any:
+        """
+        Get a fact from this host.
+
+        Facts are keyed by class name plus any arguments, eg ``File:/etc/hosts`` or
+        ``UpgradePlan:origin=security:packages=None``.
+        """
+        key_parts = [fact_cls.__name__]
         if args:
-            key = f"{fact_cls.__name__}:{args[0]}"
-            return self.facts.get(key)
-        return self.facts.get(fact_cls.__name__)
+            key_parts.append(str(args[0]))
+        key_parts.extend(f"{name}={value}" for name, value in sorted(kwargs.items()))
+        return self.facts.get(":".join(key_parts))
 
 
-def create_host(facts: Optional[FactsDict] = None) -> PyinfraTestHost:
-    """Create a PyinfraTestHost with the given facts."""
-    return PyinfraTestHost(facts=facts)
+def create_host(
+    facts: Optional[FactsDict] = None,
+    name: str = "test_host",
+    data: Optional[Dict[str, Any]] = None,
+) -> PyinfraTestHost:
+    """Create a PyinfraTestHost with the given facts and host data."""
+    return PyinfraTestHost(facts=facts, name=name, data=data)
 
 
-def parse_commands(commands: List[str]) -> List[str]:
+def parse_commands(commands: List[Any]) -> List[Union[str, List[str]]]:
     """Parse commands into a JSON-serializable format."""
-    json_commands: List[str] = []
+    json_commands: List[Union[str, List[str]]] = []
     for command in commands:
-        json_commands.append(command.strip())
+        # File uploads are represented as ["upload", src, dest]
+        if isinstance(command, FileUploadCommand):
+            json_commands.append(["upload", str(command.src), command.dest])
+        else:
+            json_commands.append(command.strip())
     return json_commands
 
 
-def assert_commands(commands: List[str], wanted_commands: List[str]) -> None:
+def assert_commands(commands: List[Any], wanted_commands: List[Any]) -> None:
     """Assert that commands match the expected commands."""
     try:
         assert commands == wanted_commands
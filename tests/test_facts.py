@@ -0,0 +1,111 @@
+"""
+Tests for home_infra facts.
+"""
+
+import json
+import os
+import shutil
+import stat
+import subprocess
+import tempfile
+from typing import Any, List, Optional
+from unittest import TestCase, skipUnless
+
+from home_infra.facts import nala
+
+
+class TestNalaFact(TestCase):
+    """Base class for testing nala facts."""
+
+    fact_cls: Any = None
+
+    def run_fact_tests(self) -> None:
+        """Run the JSON test cases for this class's fact."""
+        test_dir = os.path.join("tests", "facts", f"nala.{self.fact_cls.__name__}")
+
+        for filename in os.listdir(test_dir):
+            if not filename.endswith(".json"):
+                continue
+
+            with open(os.path.join(test_dir, filename), "r") as f:
+                test_data = json.load(f)
+
+            fact = self.fact_cls()
+            if "command" in test_data:
+                command = fact.command(*test_data.get("args", []), **test_data.get("kwargs", {}))
+                assert command == test_data["command"], filename
+            assert fact.process(test_data["output"]) == test_data["fact"], filename
+
+
+class TestNalaDpkgLockWaits(TestNalaFact):
+    """Test the nala.DpkgLockWaits fact."""
+
+    fact_cls = nala.DpkgLockWaits
+
+    def test_dpkg_lock_waits_fact(self) -> None:
+        """Test the DpkgLockWaits fact with various test cases."""
+        self.run_fact_tests()
+
+
+class TestNalaUpgradePlan(TestNalaFact):
+    """Test the nala.UpgradePlan fact."""
+
+    fact_cls = nala.UpgradePlan
+
+    def test_upgrade_plan_fact(self) -> None:
+        """Test the UpgradePlan fact with various test cases."""
+        self.run_fact_tests()
+
+    def _upgrade_targets(self, packages: Optional[List[str]], origin: Optional[str]) -> List[str]:
+        """Run the upgrade target selection against stubbed apt/apt-mark output."""
+        stubs = {
+            "apt": [
+                "Listing...",
+                "curl/stable-updates 7.88.1-10+deb12u8 amd64 [upgradable from: 7.88.1-10+deb12u7]",
+                "libssl3/stable-security 3.0.15-1 amd64 [upgradable from: 3.0.14-1]",
+                "openssl/stable-security 3.0.15-1 amd64 [upgradable from: 3.0.14-1]",
+            ],
+            "apt-mark": ["libssl3"],
+        }
+        with tempfile.TemporaryDirectory() as bin_dir:
+            for name, lines in stubs.items():
+                path = os.path.join(bin_dir, name)
+                with open(path, "w") as f:
+                    f.write("#!/bin/sh\ncat <<'EOF'\n" + "\n".join(lines) + "\nEOF\n")
+                os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+
+            result = subprocess.run(
+                ["sh", "-c", f"echo {nala._upgrade_targets(packages, origin)}"],
+                env={**os.environ, "PATH": f"{bin_dir}:{os.environ['PATH']}"},
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+        return result.stdout.split()
+
+    @skipUnless(shutil.which("sh") and shutil.which("awk"), "needs sh and awk")
+    def test_upgrade_targets_skip_held(self) -> None:
+        """Held packages are left out of both origin and package targeted upgrades."""
+        assert self._upgrade_targets(None, "security") == ["openssl"]
+        assert self._upgrade_targets(["curl", "libssl3"], None) == ["curl"]
+        assert self._upgrade_targets(None, None) == ["curl", "openssl"]
+
+
+class TestNalaArchiveCache(TestNalaFact):
+    """Test the nala.ArchiveCache fact."""
+
+    fact_cls = nala.ArchiveCache
+
+    def test_archive_cache_fact(self) -> None:
+        """Test the ArchiveCache fact with various test cases."""
+        self.run_fact_tests()
+
+
+class TestNalaPackageServices(TestNalaFact):
+    """Test the nala.PackageServices fact."""
+
+    fact_cls = nala.PackageServices
+
+    def test_package_services_fact(self) -> None:
+        """Test the PackageServices fact with various test cases."""
+        self.run_fact_tests()
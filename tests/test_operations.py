@@ -4,15 +4,17 @@ Tests for home_infra operations.
 
 import json
 import os
+import re
 from typing import Any, Callable, cast
 from unittest import TestCase
 
 import pytest
 from pyinfra.context import ctx_host, ctx_state
 
-from home_infra.operations import nala
+from home_infra.operations import artifacts, nala
 
 from .pyinfra_test_utils import (
+    PyinfraTestInventory,
     PyinfraTestState,
     assert_commands,
     create_host,
@@ -26,14 +28,23 @@ from .pyinfra_test_utils import (
 OperationFunc = Callable[..., Any]
 
 
-class TestNalaOperation(TestCase):
-    """Base class for testing nala operations."""
+class TestOperation(TestCase):
+    """Base class for testing the operations in one module."""
+
+    # Name of the operations module, eg nala
+    operation_module = ""
 
     def setUp(self) -> None:
         self.state = PyinfraTestState()
-        # Extract the operation name from the class name (e.g., TestNalaFetch -> fetch)
-        self.operation_name = self.__class__.__name__.replace("TestNala", "").lower()
-        self.test_dir = os.path.join("tests", "operations", f"nala.{self.operation_name}")
+        # Extract the operation name from the class name
+        # (e.g., TestNalaFetch -> fetch, TestNalaPauseAptTimers -> pause_apt_timers)
+        class_name = self.__class__.__name__.replace(
+            f"Test{self.operation_module.capitalize()}", ""
+        )
+        self.operation_name = re.sub(r"(?<!^)(?=[A-Z])", "_", class_name).lower()
+        self.test_dir = os.path.join(
+            "tests", "operations", f"{self.operation_module}.{self.operation_name}"
+        )
 
     @pytest.fixture(autouse=True)
     def _setup_state(self, pyinfra_state: PyinfraTestState) -> None:
@@ -50,8 +61,19 @@ class TestNalaOperation(TestCase):
             with open(test_path, "r") as f:
                 test_data = json.load(f)
 
-            # Create a host with the test facts
-            host = create_host(facts=test_data.get("facts", {}))
+            # Create a host with the test facts, plus the rest of the inventory if given
+            inventory = test_data.get("inventory", {})
+            host_name = test_data.get("host", "test_host")
+            hosts = {name: create_host(name=name, data=data) for name, data in inventory.items()}
+            host = create_host(
+                facts=test_data.get("facts", {}),
+                name=host_name,
+                data=inventory.get(host_name, {}),
+            )
+            hosts[host_name] = host
+            self.state.inventory = PyinfraTestInventory(list(hosts.values()))
+            limit = test_data.get("limit")
+            self.state.limit_hosts = [hosts[name] for name in limit] if limit else None
 
             # Get the arguments
             args = test_data.get("args", [])
@@ -68,6 +90,20 @@ class TestNalaOperation(TestCase):
             # Parse and check the commands
             commands = parse_commands(output_commands)
             assert_commands(commands, test_data["commands"])
+            if "noop" in test_data:
+                assert host.noop_description == test_data["noop"], filename
+
+
+class TestNalaOperation(TestOperation):
+    """Base class for testing nala operations."""
+
+    operation_module = "nala"
+
+
+class TestArtifactsOperation(TestOperation):
+    """Base class for testing artifacts operations."""
+
+    operation_module = "artifacts"
 
 
 class TestNalaFetch(TestNalaOperation):
@@ -92,3 +128,67 @@ class TestNalaPackages(TestNalaOperation):
     def test_packages_operation(self) -> None:
         """Test the packages operation with various test cases."""
         self.run_operation_tests(cast(OperationFunc, nala.packages))
+
+
+class TestNalaPauseAptTimers(TestNalaOperation):
+    """Test the nala.pause_apt_timers operation."""
+
+    def test_pause_apt_timers_operation(self) -> None:
+        """Test the pause_apt_timers operation with various test cases."""
+        self.run_operation_tests(cast(OperationFunc, nala.pause_apt_timers))
+
+
+class TestNalaResumeAptTimers(TestNalaOperation):
+    """Test the nala.resume_apt_timers operation."""
+
+    def test_resume_apt_timers_operation(self) -> None:
+        """Test the resume_apt_timers operation with various test cases."""
+        self.run_operation_tests(cast(OperationFunc, nala.resume_apt_timers))
+
+
+class TestNalaUpgrade(TestNalaOperation):
+    """Test the nala.upgrade operation."""
+
+    def test_upgrade_operation(self) -> None:
+        """Test the upgrade operation with various test cases."""
+        self.run_operation_tests(cast(OperationFunc, nala.upgrade))
+
+
+class TestNalaFullUpgrade(TestNalaOperation):
+    """Test the nala.full_upgrade operation."""
+
+    def test_full_upgrade_operation(self) -> None:
+        """Test the full_upgrade operation with various test cases."""
+        self.run_operation_tests(cast(OperationFunc, nala.full_upgrade))
+
+
+class TestArtifactsSeed(TestArtifactsOperation):
+    """Test the artifacts.seed operation."""
+
+    def test_seed_operation(self) -> None:
+        """Test the seed operation with various test cases."""
+        self.run_operation_tests(cast(OperationFunc, artifacts.seed))
+
+
+class TestArtifactsPull(TestArtifactsOperation):
+    """Test the artifacts.pull operation."""
+
+    def test_pull_operation(self) -> None:
+        """Test the pull operation with various test cases."""
+        self.run_operation_tests(cast(OperationFunc, artifacts.pull))
+
+
+class TestNalaLockWaitReport(TestNalaOperation):
+    """Test the nala.lock_wait_report operation."""
+
+    def test_lock_wait_report_operation(self) -> None:
+        """Test the lock_wait_report operation with various test cases."""
+        self.run_operation_tests(cast(OperationFunc, nala.lock_wait_report))
+
+
+class TestNalaArchiveCache(TestNalaOperation):
+    """Test the nala.archive_cache operation."""
+
+    def test_archive_cache_operation(self) -> None:
+        """Test the archive_cache operation with various test cases."""
+        self.run_operation_tests(cast(OperationFunc, nala.archive_cache))